@@ -1,16 +1,62 @@
 import asyncio
 import websockets
-import json
+import orjson
+import os
+import stat
 import sys
+import threading
 
 # --- UPGRADED DRIVER CLIENT ---
 
+# Frames buffered for display before the oldest ones are dropped
+DISPLAY_QUEUE_SIZE = 1024
+
+# Pre-built command frames; ids are validated with int() before formatting
+ACCEPT_TMPL = '{"action": "accept_ride", "ride_id": %d}'
+POOL_TMPL = '{"action": "accept_pooled", "pooled_id": %d}'
+COMPLETE_TMPL = '{"action": "complete_ride", "ride_id": %d}'
+
+async def open_stdin_reader():
+    """Wraps stdin in a StreamReader so lines are read on the event loop itself, or None if it can't be."""
+    # Windows loops can't watch stdin, and regular files aren't pollable. A tty is skipped too:
+    # the loop would make it O_NONBLOCK, and stdout shares that open file, so prints could fail.
+    if sys.platform == "win32" or not stat.S_ISFIFO(os.fstat(sys.stdin.fileno()).st_mode):
+        return None
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    protocol = asyncio.StreamReaderProtocol(reader)
+    try:
+        await loop.connect_read_pipe(lambda: protocol, sys.stdin)
+    except (ValueError, OSError):
+        return None
+    return reader
+
+def start_stdin_thread(loop, lines: asyncio.Queue):
+    """Reads stdin on a daemon thread, so shutdown never waits on a blocked readline. "" marks EOF."""
+    def pump():
+        try:
+            for line in iter(sys.stdin.readline, ""):
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, "")
+        except RuntimeError:
+            pass  # loop already closed
+    threading.Thread(target=pump, daemon=True).start()
+
 async def handle_user_input(websocket):
     """Handles user input to accept Normal Rides OR Pooled Rides."""
-    loop = asyncio.get_event_loop()
+    # Without a pipe reader, read lines on a daemon thread instead
+    reader = await open_stdin_reader()
+    if reader is None:
+        lines = asyncio.Queue()
+        start_stdin_thread(asyncio.get_running_loop(), lines)
     while True:
         # Read input in a way that doesn't block the websocket loop
-        user_input = await loop.run_in_executor(None, sys.stdin.readline)
+        if reader is not None:
+            user_input = (await reader.readline()).decode()
+        else:
+            user_input = await lines.get()
+        if not user_input:
+            return  # stdin closed
         parts = user_input.strip().split()
         
         if not parts:
@@ -22,7 +68,7 @@ async def handle_user_input(websocket):
         if command == "accept" and len(parts) == 2:
             try:
                 ride_id = int(parts[1])
-                await websocket.send(json.dumps({"action": "accept_ride", "ride_id": ride_id}))
+                await websocket.send(ACCEPT_TMPL % ride_id)
                 print(f"Sent request to accept NORMAL ride {ride_id}.")
             except ValueError:
                 print("Invalid ID format.")
@@ -31,7 +77,7 @@ async def handle_user_input(websocket):
         elif command == "pool" and len(parts) == 2:
             try:
                 pooled_id = int(parts[1])
-                await websocket.send(json.dumps({"action": "accept_pooled", "pooled_id": pooled_id}))
+                await websocket.send(POOL_TMPL % pooled_id)
                 print(f"Sent request to accept POOLED ride {pooled_id}.")
             except ValueError:
                 print("Invalid ID format.")
@@ -40,7 +86,7 @@ async def handle_user_input(websocket):
         elif command == "complete" and len(parts) == 2:
             try:
                 ride_id = int(parts[1])
-                await websocket.send(json.dumps({"action": "complete_ride", "ride_id": ride_id}))
+                await websocket.send(COMPLETE_TMPL % ride_id)
                 print(f"Sent request to complete ride {ride_id}.")
             except ValueError:
                 print("Invalid ID format.")
@@ -51,38 +97,69 @@ async def handle_user_input(websocket):
             print("  pool <id>    -> Accept a shared carpool ride")
             print("  complete <id> -> Finish a ride")
 
+async def receive_messages(websocket, display_q: asyncio.Queue):
+    """Pulls frames off the socket as soon as they arrive and hands them to the printer."""
+    while True:
+        message = await websocket.recv()
+        if display_q.full():
+            # Drop the oldest frame rather than stall the socket behind the printer
+            display_q.get_nowait()
+        display_q.put_nowait(message)
+
+def show_new_ride(data):
+    print(f"🔔 NORMAL RIDE Available! ID: {data['ride_id']}")
+    print(f"   From: {data['from']} -> To: {data['to']}")
+
+def show_new_rides(data):
+    for item in data["items"]:
+        show_new_ride(item)
+
+def show_ride_taken(data):
+    print(f"ℹ️ Ride {data['ride_id']} taken by Driver {data['accepted_by_driver_id']}.")
+
+def show_info(data):
+    print(f"INFO: {data['message']}")
+
+def show_error(data):
+    print(f"❌ ERROR: {data['message']}")
+
+MESSAGE_HANDLERS = {
+    "new_ride": show_new_ride,
+    "new_rides": show_new_rides,
+    "ride_taken": show_ride_taken,
+    "info": show_info,
+    "error": show_error,
+}
+
+async def print_messages(display_q: asyncio.Queue):
+    """Drains received frames and prints them, off the receive path."""
+    while True:
+        data = orjson.loads(await display_q.get())
+        handler = MESSAGE_HANDLERS.get(data.get("type"))
+
+        print(f"\n--- Server Message ---")
+        if handler:
+            handler(data)
+        print("----------------------")
+
 async def driver_logic(driver_id: int):
     uri = f"ws://127.0.0.1:8000/ws/driver/{driver_id}"
-    async with websockets.connect(uri, ping_interval=None) as websocket:
+    async with websockets.connect(uri, ping_interval=20, ping_timeout=20, compression=None) as websocket:
         print(f"--- Upgraded Driver App (ID: {driver_id}) ---")
         print(f"Connected. Ready for Normal and Pooled rides.")
         
         # Start the input listener in the background
-        asyncio.create_task(handle_user_input(websocket))
-        
-        while True:
-            try:
-                message = await websocket.recv()
-                data = json.loads(message)
-                
-                print(f"\n--- Server Message ---")
-                if data.get("type") == "new_ride":
-                    print(f"🔔 NORMAL RIDE Available! ID: {data['ride_id']}")
-                    print(f"   From: {data['start_zone']} -> To: {data['drop_zone']}")
-                
-                elif data.get("type") == "ride_taken":
-                    print(f"ℹ️ Ride {data['ride_id']} taken by Driver {data['accepted_by_driver_id']}.")
-                
-                elif data.get("type") == "info":
-                     print(f"INFO: {data['message']}")
-                
-                elif data.get("type") == "error":
-                    print(f"❌ ERROR: {data['message']}")
-                
-                print("----------------------")
-            except websockets.exceptions.ConnectionClosed:
-                print("Server disconnected. Please restart the driver app.")
-                break
+        input_task = asyncio.create_task(handle_user_input(websocket))
+
+        display_q = asyncio.Queue(maxsize=DISPLAY_QUEUE_SIZE)
+        printer = asyncio.create_task(print_messages(display_q))
+        try:
+            await receive_messages(websocket, display_q)
+        except websockets.exceptions.ConnectionClosed:
+            print("Server disconnected. Please restart the driver app.")
+        finally:
+            input_task.cancel()
+            printer.cancel()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
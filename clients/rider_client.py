@@ -1,36 +1,52 @@
 import asyncio
 import websockets
-import json
+import orjson
 import sys
 
+def show_info(data):
+    print(f"[SERVER]: {data['message']}")
+
+def show_driver_assigned(data):
+    print(f"\n[SUCCESS]: Driver {data['driver_name']} has been assigned!")
+    print(f"They will arrive in approximately {data['arrival']} minutes.")
+
+def show_ride_completed(data):
+    print("\n[SERVER]: Ride completed. Thanks for riding!")
+    return True
+
+MESSAGE_HANDLERS = {
+    "info": show_info,
+    "driver_assigned": show_driver_assigned,
+    "ride_completed": show_ride_completed,
+}
+
 async def rider_logic(rider_id: int):
     uri = f"ws://127.0.0.1:8000/ws/rider/{rider_id}"
-    # Use ping_interval=None to avoid timeouts during testing
-    async with websockets.connect(uri, ping_interval=None) as websocket:
+    # Ping every 20s to drop dead links; frames are tiny, so skip per-message deflate
+    async with websockets.connect(uri, ping_interval=20, ping_timeout=20, compression=None) as websocket:
         print(f"--- Rider App (ID: {rider_id}) ---")
         print(f"Connected to server.")
         
         try:
-            start_zone = int(input("Enter your current zone (e.g., 2): "))
-            drop_zone = int(input("Enter your destination zone (e.g., 5): "))
+            # Prompt off the event loop so keepalive pings are still answered
+            loop = asyncio.get_running_loop()
+            start_zone = int(await loop.run_in_executor(None, input, "Enter your current zone (e.g., 2): "))
+            drop_zone = int(await loop.run_in_executor(None, input, "Enter your destination zone (e.g., 5): "))
 
-            await websocket.send(json.dumps({
+            # The server reads text frames, so decode orjson's bytes before sending
+            await websocket.send(orjson.dumps({
                 "action": "request_ride",
                 "start_zone": start_zone,
                 "drop_zone": drop_zone
-            }))
+            }).decode())
             
             print("\nListening for driver assignment...")
             while True:
                 message = await websocket.recv()
-                data = json.loads(message)
-                if data.get("type") == "info":
-                    print(f"[SERVER]: {data['message']}")
-                elif data.get("type") == "driver_assigned":
-                    print(f"\n[SUCCESS]: Driver {data['driver_name']} has been assigned!")
-                    print(f"They will arrive in approximately {data['arrival_time_minutes']} minutes.")
-                elif data.get("type") == "ride_completed":
-                    print(f"\n[SERVER]: {data['message']}")
+                data = orjson.loads(message)
+                handler = MESSAGE_HANDLERS.get(data.get("type"))
+                # Handlers return True once the ride is over
+                if handler and handler(data):
                     break
         except Exception as e:
             print(f"Error or Disconnect: {e}")
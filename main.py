@@ -1,82 +1,204 @@
-from fastapi import FastAPI, WebSocket, Depends, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
-from sqlalchemy.orm import Session
-from collections import defaultdict
-from typing import List, Optional
-from server.database import engine, get_db, SessionLocal
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from server.database import engine, get_async_db, AsyncSessionLocal
 from server import models, schemas
 from server.models import BookingSource
 from server.connection_manager import ConnectionManager
-import json, random, asyncio
-from datetime import datetime, time
+import os, random, asyncio, heapq, orjson
+from datetime import datetime, time, timedelta
+from time import monotonic
 
-# --- DB RESET ON STARTUP ---
-models.Base.metadata.drop_all(bind=engine)
-models.Base.metadata.create_all(bind=engine)
+# --- DB SETUP ON STARTUP ---
+def init_db():
+    """Schema sync; run by a single process (RIDER_INIT_DB=1) rather than every worker at import."""
+    # Wipe everything only when asked (RESET_DB=1); otherwise just create whatever tables are missing
+    if os.getenv("RESET_DB") == "1":
+        models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine, checkfirst=True)
+    # create_all skips tables that already exist, so add any index they are still missing
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 # --- BACKEND BLACKLIST STORAGE ---
-DECLINED_RIDES = defaultdict(set) 
+# ride_id -> ids of drivers who declined it, oldest rides evicted past MAX_DECLINED_RIDES
+MAX_DECLINED_RIDES = 10_000
+DECLINED_RIDES = OrderedDict()
+
+def record_decline(ride_id: int, driver_id: int):
+    declined = DECLINED_RIDES.get(ride_id)
+    if declined is None:
+        declined = DECLINED_RIDES[ride_id] = set()
+        if len(DECLINED_RIDES) > MAX_DECLINED_RIDES:
+            DECLINED_RIDES.popitem(last=False)
+    else:
+        DECLINED_RIDES.move_to_end(ride_id)
+    declined.add(driver_id)
+
+# --- QUEUE CACHE ---
+# /rides/queue cards for all waiting rides, reused by polls within QUEUE_CACHE_SECONDS.
+# Anything that adds or claims a waiting ride clears it; declines are filtered per request.
+QUEUE_CACHE_SECONDS = 1.0
+QUEUE_CACHE = {"generation": 0}  # also "cards" -> (expires_at, [(ride_id, is_priority, card), ...])
+
+def invalidate_queue_cache():
+    # Bumping the generation stops a load that started before this change from being stored
+    QUEUE_CACHE.pop("cards", None)
+    QUEUE_CACHE["generation"] += 1
 
 # --- BACKGROUND SCHEDULER ---
-async def check_scheduled_rides():
+# Min-heap of (next_fire_datetime, booking_id); the scheduler sleeps until the head is due
+SCHEDULE_HEAP = []
+# Bookings with an entry on the heap, so a booking is never queued twice
+SCHEDULED_BOOKINGS = set()
+SCHEDULE_CHANGED = asyncio.Event()
+# A failed startup load or trigger batch is retried after this long
+SCHEDULER_RETRY_SECONDS = 15
+WEEKDAY_TOKENS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+@lru_cache(maxsize=1024)
+def booking_weekdays(days_of_week: str) -> frozenset:
+    """Weekday numbers (Mon=0) named in a booking's days_of_week; few distinct strings, so cached."""
+    days = days_of_week.lower()
+    return frozenset(i for i, token in enumerate(WEEKDAY_TOKENS) if token in days)
+
+def next_fire_time(days_of_week: str, time_of_day: time, after: datetime) -> Optional[datetime]:
+    """First datetime strictly after `after` on one of the booking's days, or None if it has none."""
+    weekdays = booking_weekdays(days_of_week)
+    today = after.date()
+    weekday = today.weekday()
+    for offset in range(8):
+        # Weekday by arithmetic; a date/datetime is only built for days the booking runs on
+        if (weekday + offset) % 7 in weekdays:
+            fire_at = datetime.combine(today + timedelta(days=offset), time_of_day)
+            if fire_at > after:
+                return fire_at
+    return None
+
+def schedule_booking(booking_id: int, days_of_week: str, time_of_day: time, after: datetime):
+    """Pushes the booking's next occurrence onto the heap and wakes the scheduler. Loop thread only."""
+    if booking_id in SCHEDULED_BOOKINGS:
+        return
+    fire_at = next_fire_time(days_of_week, time_of_day, after)
+    if fire_at:
+        push_schedule(fire_at, booking_id)
+
+def push_schedule(fire_at: datetime, booking_id: int):
+    heapq.heappush(SCHEDULE_HEAP, (fire_at, booking_id))
+    SCHEDULED_BOOKINGS.add(booking_id)
+    SCHEDULE_CHANGED.set()
+
+async def trigger_scheduled_rides(due: List[Tuple[datetime, int]]):
+    """Creates the rides for every (fire_at, booking_id) that came due together."""
+    async with AsyncSessionLocal() as db:
+        # One IN (...) lookup for the whole batch instead of a SELECT per booking
+        bookings = {b.id: b for b in (await db.execute(
+            select(models.Booking).where(
+                models.Booking.id.in_({booking_id for _, booking_id in due}),
+                models.Booking.status == models.BookingStatus.active
+            )
+        )).scalars()}
+        fired, rows = [], []
+        for fire_at, booking_id in due:
+            b = bookings.get(booking_id)
+            if not b:
+                continue
+            print(f"⏰ Triggering Scheduled Ride for Client {b.client_id}")
+            is_pool = (b.ride_mode == 'pool')
+            driver_pay = calculate_price_for_driver(b.start_zone, b.drop_zone, is_pool, "scheduled")
+            fired.append((b, fire_at, driver_pay))
+            rows.append(dict(
+                client_id=b.client_id,
+                start_zone=b.start_zone,
+                drop_zone=b.drop_zone,
+                is_priority=1,       # Gold Card
+                status=models.RideStatus.waiting,
+                source="scheduled",
+                price=driver_pay
+            ))
+        if not rows:
+            return
+        # One multi-row INSERT for the batch; ids come back in the same order as rows
+        ride_ids = (await db.execute(
+            insert(models.Ride).returning(models.Ride.id, sort_by_parameter_order=True), rows
+        )).scalars().all()
+        await db.commit()
+    invalidate_queue_cache()
+    for (b, fire_at, driver_pay), ride_id in zip(fired, ride_ids):
+        # Each occurrence is popped exactly once, so the next one is queued from this fire time
+        schedule_booking(b.id, b.days_of_week, b.time_of_day, fire_at)
+        manager.queue_new_ride({
+            "type": "new_ride", 
+            "ride_id": ride_id, 
+            "from": get_location_name(b.start_zone), 
+            "to": get_location_name(b.drop_zone),
+            "is_vip": True, 
+            "ride_type": b.ride_mode, 
+            "price": driver_pay
+        })
+
+async def load_active_bookings():
+    """Active bookings at startup; keeps retrying so a database that is down at boot doesn't end the scheduler."""
     while True:
         try:
-            now = datetime.now()
-            current_day = now.strftime("%a").lower()
-            current_hour = now.hour
-            current_minute = now.minute
-            db = SessionLocal()
-            bookings = db.query(models.Booking).filter(models.Booking.status == "active").all()
-            for b in bookings:
-                if current_day in b.days_of_week.lower():
-                    if b.time_of_day.hour == current_hour and b.time_of_day.minute == current_minute:
-                        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                        already_triggered = db.query(models.Ride).filter(
-                            models.Ride.client_id == b.client_id,
-                            models.Ride.source == 'scheduled',
-                            models.Ride.requested_at >= start_of_day
-                        ).first()
-
-                        if not already_triggered:
-                            print(f"⏰ Triggering Scheduled Ride for Client {b.client_id}")
-                            is_pool = (b.ride_mode == 'pool')
-                            driver_pay = calculate_price_for_driver(b.start_zone, b.drop_zone, is_pool, "scheduled")
-                            
-                            ride = models.Ride(
-                                client_id=b.client_id,
-                                start_zone=b.start_zone,
-                                drop_zone=b.drop_zone,
-                                is_priority=1,       # Gold Card
-                                status=models.RideStatus.waiting,
-                                source="scheduled",
-                                price=driver_pay
-                            )
-                            db.add(ride)
-                            db.commit()
-                            db.refresh(ride)
-                            await manager.broadcast_to_drivers({
-                                "type": "new_ride", 
-                                "ride_id": ride.id, 
-                                "from": get_location_name(b.start_zone), 
-                                "to": get_location_name(b.drop_zone),
-                                "is_vip": True, 
-                                "ride_type": b.ride_mode, 
-                                "price": ride.price
-                            })
+            async with AsyncSessionLocal() as db:
+                return (await db.execute(
+                    select(models.Booking).where(models.Booking.status == models.BookingStatus.active)
+                )).scalars().all()
         except Exception as e:
             print(f"Scheduler Error: {e}")
-        finally:
-            db.close()
-        await asyncio.sleep(15) 
+            await asyncio.sleep(SCHEDULER_RETRY_SECONDS)
+
+async def check_scheduled_rides():
+    bookings = await load_active_bookings()
+    now = datetime.now()
+    for b in bookings:
+        schedule_booking(b.id, b.days_of_week, b.time_of_day, now)
+
+    while True:
+        SCHEDULE_CHANGED.clear()
+        delay = (SCHEDULE_HEAP[0][0] - datetime.now()).total_seconds() if SCHEDULE_HEAP else None
+        try:
+            await asyncio.wait_for(SCHEDULE_CHANGED.wait(), timeout=delay)
+            continue  # a booking was added; re-check the head
+        except asyncio.TimeoutError:
+            pass
+
+        now = datetime.now()
+        due = []
+        while SCHEDULE_HEAP and SCHEDULE_HEAP[0][0] <= now:
+            fire_at, booking_id = heapq.heappop(SCHEDULE_HEAP)
+            SCHEDULED_BOOKINGS.discard(booking_id)
+            due.append((fire_at, booking_id))
+        if due:
+            try:
+                await trigger_scheduled_rides(due)
+            except Exception as e:
+                print(f"Scheduler Error: {e}")
+                # Nothing was committed, so put the whole batch back and try it again shortly
+                retry_at = datetime.now() + timedelta(seconds=SCHEDULER_RETRY_SECONDS)
+                for _, booking_id in due:
+                    if booking_id not in SCHEDULED_BOOKINGS:
+                        push_schedule(retry_at, booking_id)
 
-app = FastAPI(title="Namma Yatri Clone")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("RIDER_INIT_DB") == "1":
+        await asyncio.to_thread(init_db)
+    scheduler = asyncio.create_task(check_scheduled_rides())
+    yield
+    scheduler.cancel()
 
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(check_scheduled_rides())    
+app = FastAPI(title="Namma Yatri Clone", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
@@ -112,25 +234,57 @@ ZONE_MAP = {
 
 BASE_RATE = 20.0
 
-def get_location_name(zone_id: int):
-    return ZONE_MAP.get(zone_id, f"Zone {zone_id}")
+# Names for every id below ZONE_NAME_LIMIT, built once so lookups skip the .get + f-string
+ZONE_NAME_LIMIT = 200
+ZONE_NAMES = [ZONE_MAP.get(i, f"Zone {i}") for i in range(ZONE_NAME_LIMIT)]
+# ZONE_MAP never changes, so /config/locations serves pre-encoded bytes
+ZONE_MAP_JSON = orjson.dumps(ZONE_MAP, option=orjson.OPT_NON_STR_KEYS)
+
+@lru_cache(maxsize=512)
+def _uncommon_location_name(zone_id: int) -> str:
+    return ZONE_MAP.get(zone_id) or f"Zone {zone_id}"
+
+def get_location_name(zone_id: int) -> str:
+    if 0 <= zone_id < ZONE_NAME_LIMIT:
+        return ZONE_NAMES[zone_id]
+    return _uncommon_location_name(zone_id)
 
 # --- PRICING ---
-def calculate_price_for_driver(start: int, drop: int, is_pool: bool, source: str = "immediate") -> int:
-    dist = abs(start - drop) or 1
-    base = dist * BASE_RATE * 10
-    multiplier = 1.0
-    if is_pool:
-        multiplier = 1.5
-    if source in [BookingSource.SCHEDULED_MANUAL, BookingSource.AUTO_FEATURE, "scheduled", "auto_feature"]:
-        multiplier *= 1.2
+SCHEDULED_SOURCES = {BookingSource.SCHEDULED_MANUAL, BookingSource.AUTO_FEATURE, "scheduled", "auto_feature"}
+DRIVER_MULTIPLIERS = {
+    (False, False): 1.0, (True, False): 1.5,
+    (False, True): 1.0 * 1.2, (True, True): 1.5 * 1.2,
+}
+USER_MULTIPLIERS = {False: 1.0, True: 0.7}
+
+def _fare(dist: int, multiplier: float) -> int:
+    base = (dist or 1) * BASE_RATE * 10
     return int(base * multiplier)
 
+# Fares only depend on zone distance, so every distance between known zones is priced once here
+MAX_ZONE_DISTANCE = max(ZONE_MAP) - min(ZONE_MAP)
+DRIVER_FARES = {k: [_fare(d, m) for d in range(MAX_ZONE_DISTANCE + 1)] for k, m in DRIVER_MULTIPLIERS.items()}
+USER_FARES = {k: [_fare(d, m) for d in range(MAX_ZONE_DISTANCE + 1)] for k, m in USER_MULTIPLIERS.items()}
+
+def calculate_price_for_driver(start: int, drop: int, is_pool: bool, source: str = "immediate") -> int:
+    dist = abs(start - drop)
+    key = (bool(is_pool), source in SCHEDULED_SOURCES)
+    if dist <= MAX_ZONE_DISTANCE:
+        return DRIVER_FARES[key][dist]
+    return _fare(dist, DRIVER_MULTIPLIERS[key])
+
 def calculate_price_for_user(start: int, drop: int, is_pool: bool) -> int:
-    dist = abs(start - drop) or 1
-    base = dist * BASE_RATE * 10
-    if is_pool: return int(base * 0.7)
-    return int(base)
+    dist = abs(start - drop)
+    if dist <= MAX_ZONE_DISTANCE:
+        return USER_FARES[bool(is_pool)][dist]
+    return _fare(dist, USER_MULTIPLIERS[bool(is_pool)])
+
+# --- TRIP ETA ---
+TRIP_MINUTES = [d * 3 + 5 for d in range(MAX_ZONE_DISTANCE + 1)]
+
+def estimate_trip_minutes(start: int, drop: int) -> int:
+    dist = abs(start - drop)
+    return TRIP_MINUTES[dist] if dist <= MAX_ZONE_DISTANCE else dist * 3 + 5
 
 @app.get("/")
 def show_login(request: Request): return templates.TemplateResponse("login.html", {"request": request})
@@ -144,153 +298,248 @@ def show_rider(request: Request, client_id: int): return templates.TemplateRespo
 def show_driver(request: Request, driver_id: int): return templates.TemplateResponse("driver.html", {"request": request, "id": driver_id})
 
 @app.get("/api/client/{id}")
-def get_client_info(id: int, db: Session = Depends(get_db)):
-    return db.query(models.Client).filter(models.Client.id == id).first()
+async def get_client_info(id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.get(models.Client, id)
 
 @app.get("/api/driver/{id}")
-def get_driver_info(id: int, db: Session = Depends(get_db)):
-    return db.query(models.Driver).filter(models.Driver.id == id).first()
+async def get_driver_info(id: int, db: AsyncSession = Depends(get_async_db)):
+    return await db.get(models.Driver, id)
 
 # --- WEBSOCKETS ---
+# Sent to every driver on each accept; only the ride id changes
+QUEUE_REMOVE_FRAME = '{"type": "queue_update", "action": "remove", "ride_id": %d}'
+
+async def run_action(handler, payload: dict, user_id: int, db: AsyncSession):
+    """Runs one websocket action on the socket's session, isolating failures to that message."""
+    try:
+        await handler(payload, user_id, db)
+    except Exception as e:
+        print(f"Action Error ({payload.get('action')}): {e}")
+    finally:
+        # End any open transaction so the socket doesn't pin a pooled connection while idle
+        if db.in_transaction():
+            await db.rollback()
+
+# --- RIDER ACTIONS ---
+async def rider_price_estimate(payload: dict, rider_id: int, db: AsyncSession):
+    s = payload["start_zone"]; d = payload["drop_zone"]
+    if not manager.should_send_estimate(rider_id, s, d):
+        return
+    await manager.send_to_rider(rider_id, {
+        "type": "price_estimate", 
+        "solo": calculate_price_for_user(s,d,False), 
+        "pool": calculate_price_for_user(s,d,True)
+    })
+
+async def rider_request_ride(payload: dict, rider_id: int, db: AsyncSession):
+    s = payload["start_zone"]
+    d = payload["drop_zone"]
+    r_type = payload.get("ride_type", "solo")
+    src_str = payload.get("source", "immediate")
+    driver_pay = calculate_price_for_driver(s, d, (r_type == "pool"), src_str)
+    is_gold_ui = (src_str == "auto_feature" or src_str == BookingSource.AUTO_FEATURE)
+    # INSERT ... RETURNING id: the notification is built from what we already have, no refresh SELECT
+    ride_id = (await db.execute(insert(models.Ride).values(
+        client_id=rider_id, 
+        start_zone=s, 
+        drop_zone=d, 
+        is_priority=(1 if is_gold_ui else 0),
+        status=models.RideStatus.waiting,
+        source=src_str,
+        price=driver_pay 
+    ).returning(models.Ride.id))).scalar_one()
+    await db.commit()
+    invalidate_queue_cache()
+
+    notif = {
+        "type": "new_ride", 
+        "ride_id": ride_id, 
+        "from": get_location_name(s), 
+        "to": get_location_name(d),
+        "is_vip": is_gold_ui, 
+        "ride_type": r_type, 
+        "price": driver_pay
+    }
+    manager.queue_new_ride(notif)
+    await manager.send_to_rider(rider_id, {"type": "info", "message": "Searching..."})
+
+RIDER_ACTIONS = {
+    "get_price_estimate": rider_price_estimate,
+    "request_ride": rider_request_ride,
+}
+
 @app.websocket("/ws/rider/{rider_id}")
 async def rider_websocket(websocket: WebSocket, rider_id: int):
     await manager.connect(websocket, "rider", rider_id)
     try:
-        while True:
-            data = await websocket.receive_text()
-            payload = json.loads(data)
-
-            if payload.get("action") == "get_price_estimate":
-                s = payload["start_zone"]; d = payload["drop_zone"]
-                await manager.send_to_rider(rider_id, {
-                    "type": "price_estimate", 
-                    "solo": calculate_price_for_user(s,d,False), 
-                    "pool": calculate_price_for_user(s,d,True)
-                })
-
-            elif payload.get("action") == "request_ride":
-                db = SessionLocal()
-                try:
-                    s = payload["start_zone"]
-                    d = payload["drop_zone"]
-                    r_type = payload.get("ride_type", "solo")
-                    src_str = payload.get("source", "immediate")
-                    driver_pay = calculate_price_for_driver(s, d, (r_type == "pool"), src_str)
-                    is_gold_ui = (src_str == "auto_feature" or src_str == BookingSource.AUTO_FEATURE)
-                    ride = models.Ride(
-                        client_id=rider_id, 
-                        start_zone=s, 
-                        drop_zone=d, 
-                        is_priority=(1 if is_gold_ui else 0),
-                        status=models.RideStatus.waiting,
-                        source=src_str,
-                        price=driver_pay 
-                    )
-                    db.add(ride); db.commit(); db.refresh(ride)
-
-                    notif = {
-                        "type": "new_ride", 
-                        "ride_id": ride.id, 
-                        "from": get_location_name(s), 
-                        "to": get_location_name(d),
-                        "is_vip": is_gold_ui, 
-                        "ride_type": r_type, 
-                        "price": ride.price
-                    }
-                    await manager.broadcast_to_drivers(notif)
-                    await manager.send_to_rider(rider_id, {"type": "info", "message": "Searching..."})
-                finally:
-                    db.close()
-    except WebSocketDisconnect:
-        manager.disconnect("rider", rider_id)
+        async with AsyncSessionLocal() as db:
+            # iter_text ends cleanly when the client disconnects
+            async for data in websocket.iter_text():
+                payload = orjson.loads(data)
+                handler = RIDER_ACTIONS.get(payload.get("action"))
+                if handler:
+                    await run_action(handler, payload, rider_id, db)
+    finally:
+        # Malformed frames end the handler too; always release the slot
+        manager.disconnect("rider", rider_id, websocket)
+
+# --- DRIVER ACTIONS ---
+async def get_active_rides(driver_id: int, db: AsyncSession):
+    """(ride_id, client_id, start_zone, drop_zone) for the driver's assigned rides, cached after first load."""
+    rides = manager.get_active_rides(driver_id)
+    if rides is None:
+        rows = (await db.execute(
+            select(models.Ride.id, models.Ride.client_id, models.Ride.start_zone, models.Ride.drop_zone).where(
+                models.Ride.driver_id == driver_id,
+                models.Ride.status == models.RideStatus.assigned
+            )
+        )).all()
+        rides = manager.set_active_rides(driver_id, [tuple(r) for r in rows])
+    return rides
+
+async def driver_accept_ride(payload: dict, driver_id: int, db: AsyncSession):
+    # Claim the ride only while it is still waiting, so two drivers can't both win it
+    claimed = update(models.Ride).where(
+        models.Ride.id == payload["ride_id"],
+        models.Ride.status == models.RideStatus.waiting
+    ).values(driver_id=driver_id, status=models.RideStatus.assigned)\
+        .returning(models.Ride.id, models.Ride.driver_id, models.Ride.client_id, models.Ride.start_zone, models.Ride.drop_zone)\
+        .cte("claimed")
+    # ...and mark the driver busy in the same statement, so the claim is one round-trip
+    row = (await db.execute(
+        update(models.Driver).where(models.Driver.id == driver_id, models.Driver.id == claimed.c.driver_id)
+        .values(status=models.DriverStatus.busy)
+        .returning(models.Driver.name, models.Driver.vehicle_number,
+                   claimed.c.id, claimed.c.client_id, claimed.c.start_zone, claimed.c.drop_zone),
+        # The ORM's session sync can't follow the CTE and would swallow the RETURNING rows
+        execution_options={"synchronize_session": False}
+    )).first()
+    if row is None:
+        # Nothing committed, so run_action's rollback leaves the ride as it was
+        await manager.send_to_driver(driver_id, {"type": "error", "message": "Ride is no longer available."})
+        return
+    await db.commit()
+    invalidate_queue_cache()
+    name, vehicle, ride_id, client_id, start_zone, drop_zone = row
+    # The ride has left the queue, so nobody needs its decline list anymore
+    DECLINED_RIDES.pop(ride_id, None)
+    manager.add_active_ride(driver_id, (ride_id, client_id, start_zone, drop_zone))
+    
+    eta = random.randint(2, 8)
+    
+    await manager.send_to_rider(client_id, {
+        "type": "driver_assigned", "driver_name": name, "vehicle": vehicle, "arrival": eta
+    })
+    await manager.broadcast_text_to_drivers(QUEUE_REMOVE_FRAME % ride_id)
+
+async def driver_decline_ride(payload: dict, driver_id: int, db: AsyncSession):
+    ride_id = payload.get("ride_id")
+    if ride_id:
+        record_decline(ride_id, driver_id)
+
+async def driver_arrived(payload: dict, driver_id: int, db: AsyncSession):
+    # Pooled trips notify several riders; sends only queue frames, so a slow rider can't hold up the rest
+    for _, client_id, _, _ in await get_active_rides(driver_id, db):
+        await manager.send_to_rider(client_id, {
+            "type": "status_update", "status": "arrived", 
+            "message": "🚖 Captain Arrived!", 
+            "detail": "Waiting at pickup location."
+        })
+
+async def driver_start_trip(payload: dict, driver_id: int, db: AsyncSession):
+    for _, client_id, start_zone, drop_zone in await get_active_rides(driver_id, db):
+        await manager.send_to_rider(client_id, {
+            "type": "status_update", "status": "in_progress", 
+            "message": "🚀 Trip Started", 
+            "detail": f"ETA: {estimate_trip_minutes(start_zone, drop_zone)} mins to destination."
+        })
+
+async def driver_complete_ride(payload: dict, driver_id: int, db: AsyncSession):
+    completed = (await db.execute(
+        update(models.Ride).where(
+            models.Ride.driver_id == driver_id,
+            models.Ride.status == models.RideStatus.assigned
+        ).values(status=models.RideStatus.completed).returning(models.Ride.client_id)
+    )).scalars().all()
+    await db.execute(update(models.Driver).where(models.Driver.id == driver_id).values(status=models.DriverStatus.available))
+    await db.commit()
+    manager.clear_active_rides(driver_id)
+    for client_id in completed:
+        await manager.send_to_rider(client_id, {"type": "ride_completed"})
+
+async def driver_accept_pooled(payload: dict, driver_id: int, db: AsyncSession):
+    # Same claim pattern as accept_ride: only an open offer can be filled, in one round-trip
+    filled = (await db.execute(
+        update(models.PoolOffer).where(
+            models.PoolOffer.id == payload["pooled_id"],
+            models.PoolOffer.status == models.PoolOfferStatus.open
+        ).values(status=models.PoolOfferStatus.filled).returning(models.PoolOffer.id)
+    )).first()
+    await db.commit()
+    if filled is None:
+        await manager.send_to_driver(driver_id, {"type": "error", "message": "Pool offer is no longer open."})
+
+DRIVER_ACTIONS = {
+    "accept_ride": driver_accept_ride,
+    "decline_ride": driver_decline_ride,
+    "driver_arrived": driver_arrived,
+    "start_trip": driver_start_trip,
+    "complete_ride": driver_complete_ride,
+    "accept_pooled": driver_accept_pooled,
+}
 
 @app.websocket("/ws/driver/{driver_id}")
 async def driver_websocket(websocket: WebSocket, driver_id: int):
     await manager.connect(websocket, "driver", driver_id)
     try:
-        while True:
-            data = await websocket.receive_text()
-            payload = json.loads(data)
-            action = payload.get("action")
-            db = SessionLocal()
-            try:
-                if action == "accept_ride":
-                    ride = db.query(models.Ride).filter(models.Ride.id == payload["ride_id"]).first()
-                    driver = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
-                    if ride:
-                        ride.driver_id = driver_id; ride.status = models.RideStatus.assigned
-                        driver.status = models.DriverStatus.busy
-                        db.commit()
-                        
-                        eta = random.randint(2, 8)
-                        
-                        await manager.send_to_rider(ride.client_id, {
-                            "type": "driver_assigned", "driver_name": driver.name, "vehicle": driver.vehicle_number, "arrival": eta
-                        })
-                        await manager.broadcast_to_drivers({"type": "queue_update", "action": "remove", "ride_id": ride.id})
-
-                # --- DECLINE LOGIC IMPLEMENTED ---
-                elif action == "decline_ride":
-                    ride_id = payload.get("ride_id")
-                    if ride_id:
-                        DECLINED_RIDES[ride_id].add(driver_id)
-                # ---------------------------------
-
-                elif action in ["driver_arrived", "start_trip", "complete_ride"]:
-                    active_rides = db.query(models.Ride).filter(
-                        models.Ride.driver_id == driver_id,
-                        models.Ride.status == models.RideStatus.assigned
-                    ).all()
-
-                    for r in active_rides:
-                        if action == "driver_arrived":
-                            await manager.send_to_rider(r.client_id, {
-                                "type": "status_update", "status": "arrived", 
-                                "message": "🚖 Captain Arrived!", 
-                                "detail": "Waiting at pickup location."
-                            })
-                        
-                        elif action == "start_trip":
-                            dist_est = abs(r.start_zone - r.drop_zone) * 3 + 5
-                            await manager.send_to_rider(r.client_id, {
-                                "type": "status_update", "status": "in_progress", 
-                                "message": "🚀 Trip Started", 
-                                "detail": f"ETA: {dist_est} mins to destination."
-                            })
-
-                        elif action == "complete_ride":
-                            r.status = models.RideStatus.completed
-                            await manager.send_to_rider(r.client_id, {"type": "ride_completed"})
-                    
-                    if action == "complete_ride":
-                        db.query(models.Driver).filter(models.Driver.id == driver_id).update({"status": models.DriverStatus.available})
-                    db.commit()
-
-                elif action == "accept_pooled":
-                    pool_id = payload["pooled_id"]
-                    offer = db.query(models.PoolOffer).filter(models.PoolOffer.id == pool_id).first()
-                    if offer and offer.status == models.PoolOfferStatus.open:
-                        offer.status = models.PoolOfferStatus.filled
-            finally:
-                db.close()
-    except WebSocketDisconnect:
-        manager.disconnect("driver", driver_id)
+        async with AsyncSessionLocal() as db:
+            async for data in websocket.iter_text():
+                payload = orjson.loads(data)
+                handler = DRIVER_ACTIONS.get(payload.get("action"))
+                if handler:
+                    await run_action(handler, payload, driver_id, db)
+    finally:
+        manager.disconnect("driver", driver_id, websocket)
 
 @app.get("/config/locations")   
-def get_locs(): return ZONE_MAP
+def get_locs(): return Response(content=ZONE_MAP_JSON, media_type="application/json")
 
 # --- QUEUE & HISTORY ---
 @app.get("/rides/queue")
-def get_q(driver_id: Optional[int] = None, db: Session=Depends(get_db)):
-    waiting = db.query(models.Ride).filter(models.Ride.status == models.RideStatus.waiting)\
-        .order_by(models.Ride.requested_at.asc()).all()
-    if driver_id:
-        waiting = [r for r in waiting if driver_id not in DECLINED_RIDES[r.id]]
+async def get_q(driver_id: Optional[int] = None, db: AsyncSession=Depends(get_async_db)):
+    cached = QUEUE_CACHE.get("cards")
+    if cached and cached[0] > monotonic():
+        cards = cached[1]
+    else:
+        generation = QUEUE_CACHE["generation"]
+        cards = await load_queue_cards(db)
+        if QUEUE_CACHE["generation"] == generation:
+            QUEUE_CACHE["cards"] = (monotonic() + QUEUE_CACHE_SECONDS, cards)
     vip_data, norm_data = [], []
+    for ride_id, is_priority, ride_obj in cards:
+        if driver_id and driver_id in DECLINED_RIDES.get(ride_id, ()):
+            continue
+        if is_priority:
+            vip_data.append(ride_obj)
+        else:
+            norm_data.append(ride_obj)
+    # Plain dicts, so encode with orjson directly instead of going through jsonable_encoder
+    return Response(content=orjson.dumps({"vip": vip_data, "standard": norm_data, "active": [], "drivers": []}),
+                    media_type="application/json")
+
+async def load_queue_cards(db: AsyncSession):
+    """(ride_id, is_priority, card) for every waiting ride, priority first then request order."""
+    # Only the columns the cards show, with the client's name joined in: one query, no ORM objects built
+    R = models.Ride
+    query = select(R.id, R.client_id, models.Client.name, R.start_zone, R.drop_zone, R.is_priority, R.price, R.source)\
+        .outerjoin(models.Client, models.Client.id == R.client_id)\
+        .where(R.status == models.RideStatus.waiting)
+    # Matches ix_ride_waiting_queue; each of the vip/standard lists stays in request order
+    waiting = (await db.execute(query.order_by(R.is_priority.desc(), R.requested_at.asc()))).all()
+    cards = []
     for r in waiting:
-        client = db.query(models.Client).filter(models.Client.id == r.client_id).first()
-        client_name = client.name if client else "Unknown User"
-        r_source = getattr(r, "source", "immediate")
+        client_name = r.name or "Unknown User"
+        r_source = r.source or "immediate"
         ui_class = "card-gold" if r_source in ["scheduled", "auto_feature", BookingSource.AUTO_FEATURE] else "card-normal"
         final_price = r.price if r.price else 0
         ride_obj = { 
@@ -303,40 +552,52 @@ def get_q(driver_id: Optional[int] = None, db: Session=Depends(get_db)):
             "price": final_price,
             "ui_class": ui_class
         }
-        if r.is_priority:
-            vip_data.append(ride_obj)
-        else:
-            norm_data.append(ride_obj)
-    return {"vip": vip_data, "standard": norm_data, "active": [], "drivers": []}
+        cards.append((r.id, r.is_priority, ride_obj))
+    return cards
 
 @app.get("/pooling/offers")
-def list_pools(db: Session=Depends(get_db)):
-    offers = db.query(models.PoolOffer).filter(models.PoolOffer.status == models.PoolOfferStatus.open).all()
+async def list_pools(db: AsyncSession=Depends(get_async_db)):
+    seats = func.count(models.PoolOfferBookingRide.booking_ride_id)
+    offers = (await db.execute(select(models.PoolOffer, seats)\
+        .outerjoin(models.PoolOfferBookingRide, models.PoolOfferBookingRide.pool_offer_id == models.PoolOffer.id)\
+        .where(models.PoolOffer.status == models.PoolOfferStatus.open)\
+        .group_by(models.PoolOffer.id))).all()
     results = []
-    for o in offers:
-        ride_ids = json.loads(o.booking_ride_ids)
+    for o, seats_filled in offers:
         base = calculate_price_for_driver(o.start_zone, o.drop_zone, True, True) 
-        results.append({"id": o.id, "from": get_location_name(o.start_zone), "to": get_location_name(o.drop_zone), "seats_filled": len(ride_ids), "value": base})
-    return results
+        results.append({"id": o.id, "from": get_location_name(o.start_zone), "to": get_location_name(o.drop_zone), "seats_filled": seats_filled, "value": base})
+    return Response(content=orjson.dumps(results), media_type="application/json")
 
 @app.get("/rides/history/{role}/{user_id}")
-def get_hist(role: str, user_id: int, db: Session=Depends(get_db)):
+async def get_hist(role: str, user_id: int, db: AsyncSession=Depends(get_async_db)):
     return [] 
 @app.get("/bookings/{client_id}/upcoming")
-def get_upcoming(client_id: int, db: Session=Depends(get_db)): return []
+async def get_upcoming(client_id: int, db: AsyncSession=Depends(get_async_db)): return []
 @app.get("/clients/{cid}/subscription_status")
-def check_sub(cid: int, db: Session=Depends(get_db)): 
-    sub = db.query(models.Booking).filter(models.Booking.client_id == cid, models.Booking.status == models.BookingStatus.active).first()
+async def check_sub(cid: int, db: AsyncSession=Depends(get_async_db)): 
+    sub = (await db.execute(select(models.Booking.id).where(models.Booking.client_id == cid, models.Booking.status == models.BookingStatus.active).limit(1))).first()
     return {"is_vip": sub is not None}
 @app.post("/pooling/{oid}/accept")
-def acc_pool(oid: int, db: Session=Depends(get_db)): return {}
+async def acc_pool(oid: int, db: AsyncSession=Depends(get_async_db)): return {}
 @app.post("/clients/register", response_model=schemas.Client)
-def rc(c: schemas.ClientCreate, db: Session=Depends(get_db)): x=models.Client(**c.dict()); db.add(x); db.commit(); db.refresh(x); return x
+async def rc(c: schemas.ClientCreate, db: AsyncSession=Depends(get_async_db)):
+    x=(await db.execute(insert(models.Client).values(**c.model_dump()).returning(models.Client))).scalar_one(); await db.commit(); return x
 @app.post("/drivers/register", response_model=schemas.Driver)
-def rd(d: schemas.DriverCreate, db: Session=Depends(get_db)): x=models.Driver(**d.dict()); db.add(x); db.commit(); db.refresh(x); return x
+async def rd(d: schemas.DriverCreate, db: AsyncSession=Depends(get_async_db)):
+    x=(await db.execute(insert(models.Driver).values(**d.model_dump()).returning(models.Driver))).scalar_one(); await db.commit(); return x
 @app.post("/bookings/", response_model=schemas.BookingOut)
-def rb(b: schemas.BookingCreate, db: Session=Depends(get_db)):
+async def rb(b: schemas.BookingCreate, db: AsyncSession=Depends(get_async_db)):
     days=",".join(b.days_of_week)
     mode=getattr(b, 'ride_mode', 'pool') 
-    x=models.Booking(client_id=b.client_id, start_zone=b.start_zone, drop_zone=b.drop_zone, days_of_week=days, time_of_day=b.time_of_day, start_date=b.start_date, ride_mode=mode, monthly_price=b.monthly_price)
-    db.add(x); db.commit(); db.refresh(x); return x
\ No newline at end of file
+    # One INSERT ... RETURNING round-trip instead of add + commit + refresh
+    stmt=insert(models.Booking).values(client_id=b.client_id, start_zone=b.start_zone, drop_zone=b.drop_zone, days_of_week=days, time_of_day=b.time_of_day, start_date=b.start_date, ride_mode=mode, monthly_price=b.monthly_price).returning(models.Booking)
+    x=(await db.execute(stmt)).scalar_one(); await db.commit()
+    schedule_booking(x.id, x.days_of_week, x.time_of_day, datetime.now())
+    return x
+if __name__ == "__main__":
+    import uvicorn
+    # Single worker: ConnectionManager and the schedule heap live in this process's memory.
+    # Frames are small JSON, so per-message deflate would cost more CPU than it saves.
+    # loop/http stay "auto": uvloop and httptools when installed (not on Windows), asyncio/h11 otherwise
+    uvicorn.run(app, host="127.0.0.1", port=8000, workers=1, loop="auto", http="auto",
+                ws="websockets", ws_per_message_deflate=False)
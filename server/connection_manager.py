@@ -1,40 +1,158 @@
 from fastapi import WebSocket
-from typing import Dict
-import json
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import time
+import orjson
+
+# Repeat estimates for the same route inside this window are dropped
+ESTIMATE_DEBOUNCE_SECONDS = 0.05
+# new_ride notifications raised within this window go out as one frame per driver
+NEW_RIDE_BATCH_SECONDS = 0.01
+# Frames buffered per socket for a client that can't keep up; past this, broadcast frames
+# are dropped oldest-first and a direct frame disconnects the stalled socket instead
+OUTBOX_SIZE = 256
 
 class ConnectionManager:
     def __init__(self):
         self.driver_connections: Dict[int, WebSocket] = {}
         self.rider_connections: Dict[int, WebSocket] = {}
+        # Assigned rides per driver as (ride_id, client_id, start_zone, drop_zone)
+        self.driver_active_rides: Dict[int, List[Tuple[int, int, int, int]]] = {}
+        # Last estimate sent per rider as (start_zone, drop_zone, monotonic time)
+        self.last_estimates: Dict[int, Tuple[int, int, float]] = {}
+        self.pending_new_rides: List[dict] = []
+        self.new_ride_flush: Optional[asyncio.Task] = None
+        # Per-socket outbound frames as (text, is_broadcast), the event waking its writer, and the writer task
+        self.outboxes: Dict[WebSocket, Tuple[Deque[Tuple[str, bool]], asyncio.Event, asyncio.Task]] = {}
+        # Closes of stalled sockets still running; held so they aren't garbage-collected mid-close
+        self.closing: Set[asyncio.Task] = set()
 
     async def connect(self, websocket: WebSocket, client_type: str, client_id: int):
         await websocket.accept()
+        outbox, ready = deque(), asyncio.Event()
+        writer = asyncio.create_task(self._writer(websocket, outbox, ready, client_type, client_id))
+        self.outboxes[websocket] = (outbox, ready, writer)
         if client_type == "driver":
             self.driver_connections[client_id] = websocket
         elif client_type == "rider":
             self.rider_connections[client_id] = websocket
 
-    def disconnect(self, client_type: str, client_id: int):
-        if client_type == "driver" and client_id in self.driver_connections:
-            del self.driver_connections[client_id]
-        elif client_type == "rider" and client_id in self.rider_connections:
-            del self.rider_connections[client_id]
+    def disconnect(self, client_type: str, client_id: int, websocket: Optional[WebSocket] = None):
+        connections = self.driver_connections if client_type == "driver" else self.rider_connections
+        current = connections.get(client_id)
+        websocket = websocket or current
+        if websocket is not None and websocket in self.outboxes:
+            _, _, writer = self.outboxes.pop(websocket)
+            writer.cancel()
+        # With a websocket given, only remove that exact socket so a newer reconnect survives
+        if current is not None and current is websocket:
+            del connections[client_id]
+            if client_type == "driver":
+                self.driver_active_rides.pop(client_id, None)
+            else:
+                self.last_estimates.pop(client_id, None)
+
+    async def _writer(self, websocket: WebSocket, outbox: Deque[Tuple[str, bool]], ready: asyncio.Event,
+                      client_type: str, client_id: int):
+        """Sends queued frames in order, so a slow client only ever holds up its own queue."""
+        try:
+            while True:
+                while not outbox:
+                    ready.clear()
+                    await ready.wait()
+                await websocket.send_text(outbox.popleft()[0])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket is gone; drop it so later sends skip it
+            self.disconnect(client_type, client_id, websocket)
+
+    def _enqueue(self, websocket: WebSocket, text: str, client_type: str, client_id: int, is_broadcast: bool = False):
+        entry = self.outboxes.get(websocket)
+        if entry is None:
+            return
+        outbox, ready, _ = entry
+        if len(outbox) >= OUTBOX_SIZE:
+            if not is_broadcast:
+                # A direct frame (driver_assigned, ride_completed, ...) must not be lost: cut the client off
+                self.disconnect(client_type, client_id, websocket)
+                task = asyncio.create_task(self._close_stalled(websocket))
+                self.closing.add(task)
+                task.add_done_callback(self.closing.discard)
+                return
+            # Broadcasts are only hints to refetch the queue; make room by dropping the oldest one
+            oldest = next((i for i, (_, broadcast) in enumerate(outbox) if broadcast), None)
+            if oldest is None:
+                return  # all direct frames; skip this broadcast
+            del outbox[oldest]
+        outbox.append((text, is_broadcast))
+        ready.set()
+
+    async def _close_stalled(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception as e:
+            print(f"Close Error: {e}")
+
+    def should_send_estimate(self, rider_id: int, start_zone: int, drop_zone: int) -> bool:
+        """False if this rider was sent the same route's estimate within the debounce window."""
+        now = time.monotonic()
+        last = self.last_estimates.get(rider_id)
+        if last and last[0] == start_zone and last[1] == drop_zone and now - last[2] < ESTIMATE_DEBOUNCE_SECONDS:
+            return False
+        self.last_estimates[rider_id] = (start_zone, drop_zone, now)
+        return True
+
+    def get_active_rides(self, driver_id: int) -> Optional[List[Tuple[int, int, int, int]]]:
+        """Cached assigned rides, or None if they haven't been loaded for this driver yet."""
+        return self.driver_active_rides.get(driver_id)
+
+    def set_active_rides(self, driver_id: int, rides: List[Tuple[int, int, int, int]]):
+        self.driver_active_rides[driver_id] = rides
+        return rides
+
+    def add_active_ride(self, driver_id: int, ride: Tuple[int, int, int, int]):
+        # Only extend a loaded cache; otherwise the next lookup reads every assigned ride from the DB
+        if driver_id in self.driver_active_rides:
+            self.driver_active_rides[driver_id].append(ride)
+
+    def clear_active_rides(self, driver_id: int):
+        self.driver_active_rides[driver_id] = []
+
+    def queue_new_ride(self, message: dict):
+        """Buffers a new_ride notification; the first one in a window schedules the flush."""
+        self.pending_new_rides.append(message)
+        if self.new_ride_flush is None:
+            self.new_ride_flush = asyncio.create_task(self._flush_new_rides_later())
+
+    async def _flush_new_rides_later(self):
+        await asyncio.sleep(NEW_RIDE_BATCH_SECONDS)
+        await self.flush_new_rides()
+
+    async def flush_new_rides(self):
+        """Sends whatever is buffered now: a lone ride as a plain new_ride frame, several as new_rides."""
+        self.new_ride_flush = None
+        pending, self.pending_new_rides = self.pending_new_rides, []
+        if len(pending) == 1:
+            await self.broadcast_to_drivers(pending[0])
+        elif pending:
+            await self.broadcast_to_drivers({"type": "new_rides", "items": pending})
 
     async def broadcast_to_drivers(self, message: dict):
-        text = json.dumps(message)
-        for connection in list(self.driver_connections.values()):
-            try:
-                await connection.send_text(text)
-            except Exception:
-                # ignore send errors — connection cleanup will happen on disconnect
-                pass
+        # Encode once for every driver; sent as text because the browser clients JSON.parse the frame
+        await self.broadcast_text_to_drivers(orjson.dumps(message).decode())
+
+    async def broadcast_text_to_drivers(self, text: str):
+        """Queues an already-encoded JSON frame for every driver."""
+        for driver_id, ws in list(self.driver_connections.items()):
+            self._enqueue(ws, text, "driver", driver_id, is_broadcast=True)
 
+    # The send methods only enqueue; they stay async so callers can keep awaiting or gathering them
     async def send_to_rider(self, rider_id: int, message: dict):
         if rider_id in self.rider_connections:
-            websocket = self.rider_connections[rider_id]
-            await websocket.send_text(json.dumps(message))
+            self._enqueue(self.rider_connections[rider_id], orjson.dumps(message).decode(), "rider", rider_id)
 
     async def send_to_driver(self, driver_id: int, message: dict):
         if driver_id in self.driver_connections:
-            websocket = self.driver_connections[driver_id]
-            await websocket.send_text(json.dumps(message))
+            self._enqueue(self.driver_connections[driver_id], orjson.dumps(message).decode(), "driver", driver_id)
@@ -1,6 +1,8 @@
 from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 
@@ -10,14 +12,35 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set in environment variables")
 
-engine = create_engine(DATABASE_URL, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The async engine serves all traffic with up to pool_size + max_overflow = 30 connections per
+# worker process; size Postgres max_connections (or PgBouncer) for workers * 30.
+# pre_ping drops connections the server closed while they sat idle in the pool.
+POOL_OPTIONS = dict(pool_size=20, max_overflow=10, pool_timeout=30, pool_recycle=3600, pool_pre_ping=True)
+
+_url = make_url(DATABASE_URL)
+# psycopg2 is the sync driver in requirements; name it, since SQLAlchemy 2.1 defaults to psycopg 3
+SYNC_DATABASE_URL = _url.set(drivername="postgresql+psycopg2") if _url.drivername == "postgresql" else _url
+
+# Sync engine only runs init_db's DDL, so it opens a connection for that and closes it again
+engine = create_engine(SYNC_DATABASE_URL, future=True, poolclass=NullPool)
 Base = declarative_base()
 
+def asyncpg_query(query):
+    """libpq URL parameters -> asyncpg.connect keywords; libpq-only keys would make it raise TypeError."""
+    translated = {}
+    if "sslmode" in query:
+        translated["ssl"] = query["sslmode"]  # asyncpg takes the same mode names
+    for key in ("ssl", "prepared_statement_cache_size"):
+        if key in query:
+            translated[key] = query[key]
+    return translated
+
+# Same database through asyncpg; every route and websocket handler uses this one
+ASYNC_DATABASE_URL = _url.set(drivername="postgresql+asyncpg", query=asyncpg_query(_url.query))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, func, Time, Date, Text
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, func, Time, Date, Index
+from sqlalchemy.dialects.postgresql import JSONB
 import enum
 from .database import Base
 
@@ -53,6 +54,16 @@ class Ride(Base):
     price = Column(Integer, default=0)
     requested_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_ride_driver_status", "driver_id", "status"),  # a driver's assigned rides
+    )
+
+# /rides/queue: priority first, then FCFS. Partial, so it only ever holds waiting rides
+Index(
+    "ix_ride_waiting_queue", Ride.is_priority.desc(), Ride.requested_at,
+    postgresql_where=(Ride.status == RideStatus.waiting),
+)
+
 class Booking(Base):
     __tablename__ = "bookings"
     id = Column(Integer, primary_key=True, index=True)
@@ -68,6 +79,10 @@ class Booking(Base):
     status = Column(Enum(BookingStatus), default=BookingStatus.active)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_booking_client_status", "client_id", "status"),  # subscription status
+    )
+
 class BookingRide(Base):
     __tablename__ = "booking_rides"
     id = Column(Integer, primary_key=True, index=True)
@@ -86,18 +101,29 @@ class PoolOfferStatus(str, enum.Enum):
 class PoolOffer(Base):
     __tablename__ = "pool_offers"
     id = Column(Integer, primary_key=True, index=True)
-    booking_ride_ids = Column(Text, nullable=False)
     start_zone = Column(Integer, nullable=False)
     drop_zone = Column(Integer, nullable=False) 
     scheduled_for = Column(DateTime(timezone=True), nullable=False)
     status = Column(Enum(PoolOfferStatus), default=PoolOfferStatus.open)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+# /pooling/offers: only open offers are listed, so filled/expired history stays out of the index
+Index(
+    "ix_pooloffer_open", PoolOffer.scheduled_for, PoolOffer.start_zone, PoolOffer.drop_zone,
+    postgresql_where=(PoolOffer.status == PoolOfferStatus.open),
+)
+
+class PoolOfferBookingRide(Base):
+    # One row per booking ride grouped into an offer; seats are counted in SQL
+    __tablename__ = "pool_offer_booking_rides"
+    pool_offer_id = Column(Integer, ForeignKey("pool_offers.id"), primary_key=True)
+    booking_ride_id = Column(Integer, ForeignKey("booking_rides.id"), primary_key=True)
+
 class PooledRide(Base):
     __tablename__ = "pooled_rides"
     id = Column(Integer, primary_key=True, index=True)
-    client_ids = Column(Text, nullable=False)
-    booking_ride_ids = Column(Text, nullable=True)
+    client_ids = Column(JSONB, nullable=False)  # list of client ids
+    booking_ride_ids = Column(JSONB, nullable=True)  # list of booking ride ids
     driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=True)
     start_zone = Column(Integer, nullable=False)
     drop_zone = Column(Integer, nullable=False)
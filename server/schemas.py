@@ -93,7 +93,6 @@ class BookingRideOut(BaseModel):
 # ----------------------
 class PoolOfferOut(BaseModel):
     id: int
-    booking_ride_ids: str  # JSON string of ids
     start_zone: int
     drop_zone: int
     scheduled_for: datetime
@@ -110,8 +109,8 @@ class PoolAcceptIn(BaseModel):
 
 class PooledRideOut(BaseModel):
     id: int
-    client_ids: str
-    booking_ride_ids: Optional[str]
+    client_ids: List[int]
+    booking_ride_ids: Optional[List[int]]
     driver_id: Optional[int]
     start_zone: int
     drop_zone: int